@@ -71,6 +71,7 @@ if sys.version_info >= (3, 0):
   import http.client as httpclient
   import io as stringio
   import urllib.error as urlerror
+  import urllib.parse as urljoin
   import urllib.parse as urlparse
   import urllib.request as urlrequest
   import urllib.request as urlretrieve
@@ -80,6 +81,7 @@ else:
   import httplib as httpclient
   import StringIO as stringio
   import urllib as urlparse
+  import urlparse as urljoin
   import urllib as urlretrieve
   import urllib2 as urlrequest
   import urllib2 as urlerror
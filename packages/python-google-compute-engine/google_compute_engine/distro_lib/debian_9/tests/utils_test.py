@@ -22,9 +22,13 @@ from google_compute_engine.test_compat import unittest
 
 class UtilsTest(unittest.TestCase):
 
+  @classmethod
+  def setUpClass(cls):
+    cls.mock_setup = mock.create_autospec(utils.Utils)
+
   def setUp(self):
     self.mock_logger = mock.Mock()
-    self.mock_setup = mock.create_autospec(utils.Utils)
+    self.mock_setup.reset_mock()
 
   @mock.patch('google_compute_engine.distro_lib.helpers.CallDhclientIpv6')
   @mock.patch('google_compute_engine.distro_lib.helpers.CallEnableRouteAdvertisements')
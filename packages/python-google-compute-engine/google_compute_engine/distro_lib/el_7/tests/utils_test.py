@@ -27,12 +27,16 @@ from google_compute_engine.test_compat import unittest
 
 class UtilsTest(unittest.TestCase):
 
+  @classmethod
+  def setUpClass(cls):
+    cls.mock_setup = mock.create_autospec(utils.Utils)
+    cls.mock_setup.network_path = '/etc/sysconfig/network-scripts'
+
   def setUp(self):
     # Create a temporary directory.
     self.test_dir = tempfile.mkdtemp()
     self.mock_logger = mock.Mock()
-    self.mock_setup = mock.create_autospec(utils.Utils)
-    self.mock_setup.network_path = '/etc/sysconfig/network-scripts'
+    self.mock_setup.reset_mock()
 
   def tearDown(self):
     # Remove the directory after the test.
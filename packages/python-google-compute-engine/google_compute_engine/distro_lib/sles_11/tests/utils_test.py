@@ -14,18 +14,22 @@
 # limitations under the License.
 """Unittest for utils.py module."""
 
-import subprocess
-
 from google_compute_engine.distro_lib.sles_11 import utils
+from google_compute_engine.test_compat import builtin
 from google_compute_engine.test_compat import mock
 from google_compute_engine.test_compat import unittest
 
 
 class UtilsTest(unittest.TestCase):
 
+  @classmethod
+  def setUpClass(cls):
+    cls.mock_setup = mock.create_autospec(utils.Utils)
+    cls.mock_setup.dhcpcd_command = utils.Utils.dhcpcd_command
+
   def setUp(self):
     self.mock_logger = mock.Mock()
-    self.mock_setup = mock.create_autospec(utils.Utils)
+    self.mock_setup.reset_mock()
 
   def testEnableNetworkInterfacesWithSingleNic(self):
     mocks = mock.Mock()
@@ -46,31 +50,72 @@ class UtilsTest(unittest.TestCase):
     ]
     self.assertEqual(mocks.mock_calls, expected_calls)
 
-  @mock.patch(
-      'google_compute_engine.distro_lib.sles_11.utils.subprocess.check_call')
-  def testDhcpcd(self, mock_call):
+  @mock.patch('google_compute_engine.distro_lib.sles_11.utils.subprocess.Popen')
+  def testDhcpcd(self, mock_popen):
+    mock_open = mock.mock_open()
+    mock_devnull = mock_open()
     mocks = mock.Mock()
-    mocks.attach_mock(mock_call, 'call')
+    mocks.attach_mock(mock_popen, 'popen')
     mocks.attach_mock(self.mock_logger, 'logger')
-    mock_call.side_effect = [
-        None, None, None, None,
-        subprocess.CalledProcessError(1, 'Test'),
-        subprocess.CalledProcessError(1, 'Test'),
-    ]
+    mock_process = mock.Mock()
+    mock_process.wait.side_effect = [0, 0, 1, 0, 0, 1]
+    mock_popen.return_value = mock_process
 
-    utils.Utils._Dhcpcd(
-        self.mock_setup, ['eth1', 'eth2', 'eth3'], self.mock_logger)
+    with mock.patch('%s.open' % builtin, mock_open, create=False):
+      utils.Utils._Dhcpcd(
+          self.mock_setup, ['eth1', 'eth2', 'eth3'], self.mock_logger)
     expected_calls = [
-        mock.call.call(['/sbin/dhcpcd', '-x', 'eth1']),
-        mock.call.call(['/sbin/dhcpcd', 'eth1']),
-        mock.call.call(['/sbin/dhcpcd', '-x', 'eth2']),
-        mock.call.call(['/sbin/dhcpcd', 'eth2']),
-        mock.call.call(['/sbin/dhcpcd', '-x', 'eth3']),
+        mock.call.popen(
+            ('/sbin/dhcpcd', '-x', 'eth1'),
+            stdout=mock_devnull, stderr=mock_devnull),
+        mock.call.popen(
+            ('/sbin/dhcpcd', '-x', 'eth2'),
+            stdout=mock_devnull, stderr=mock_devnull),
+        mock.call.popen(
+            ('/sbin/dhcpcd', '-x', 'eth3'),
+            stdout=mock_devnull, stderr=mock_devnull),
+        mock.call.popen().wait(),
+        mock.call.popen().wait(),
+        mock.call.popen().wait(),
         mock.call.logger.info(mock.ANY, 'eth3'),
-        mock.call.call(['/sbin/dhcpcd','eth3']),
+        mock.call.popen(
+            ('/sbin/dhcpcd', 'eth1'), stdout=mock_devnull, stderr=mock_devnull),
+        mock.call.popen(
+            ('/sbin/dhcpcd', 'eth2'), stdout=mock_devnull, stderr=mock_devnull),
+        mock.call.popen(
+            ('/sbin/dhcpcd', 'eth3'), stdout=mock_devnull, stderr=mock_devnull),
+        mock.call.popen().wait(),
+        mock.call.popen().wait(),
+        mock.call.popen().wait(),
         mock.call.logger.warning(mock.ANY, 'eth3'),
     ]
     self.assertEqual(mocks.mock_calls, expected_calls)
+    mock_open.assert_called_with(utils.os.devnull, 'w')
+
+  @mock.patch('google_compute_engine.distro_lib.sles_11.utils.subprocess.Popen')
+  def testDhcpcdOSError(self, mock_popen):
+    mocks = mock.Mock()
+    mocks.attach_mock(self.mock_logger, 'logger')
+    mock_process = mock.Mock()
+    mock_process.wait.return_value = 0
+    mock_popen.side_effect = [
+        mock_process, OSError('Error.'), mock_process,
+        mock_process, OSError('Error.'), mock_process,
+    ]
+
+    with mock.patch('%s.open' % builtin, mock.mock_open(), create=False):
+      utils.Utils._Dhcpcd(
+          self.mock_setup, ['eth1', 'eth2', 'eth3'], self.mock_logger)
+    # Processes started before and after the failure are waited on.
+    self.assertEqual(mock_popen.call_count, 6)
+    self.assertEqual(mock_process.wait.call_count, 4)
+    expected_calls = [
+        mock.call.logger.warning(
+            'Could not run dhcpcd for interface %s. %s.', 'eth2', 'Error.'),
+        mock.call.logger.warning(
+            'Could not run dhcpcd for interface %s. %s.', 'eth2', 'Error.'),
+    ]
+    self.assertEqual(mocks.mock_calls, expected_calls)
 
   @mock.patch('google_compute_engine.distro_lib.helpers.CallHwclock')
   def testHandleClockSync(self, mock_call):
@@ -27,6 +27,8 @@ from google_compute_engine.distro_lib import utils
 class Utils(utils.Utils):
   """Utilities used by Linux guest services on SUSE 11."""
 
+  dhcpcd_command = ('/sbin/dhcpcd',)
+
   def EnableIpv6(self, interfaces, logger, dhclient_script=None):
     """Configure the network interfaces for IPv6 using dhclient.
 
@@ -57,18 +59,35 @@ class Utils(utils.Utils):
       interfaces: list of string, the output device names to enable.
       logger: logger object, used to write to SysLog and serial port.
     """
-    for interface in interfaces:
-      dhcpcd = ['/sbin/dhcpcd']
-      try:
-        subprocess.check_call(dhcpcd + ['-x', interface])
-      except subprocess.CalledProcessError:
-        # Dhcpcd not yet running for this device.
-        logger.info('Dhcpcd not yet running for interface %s.', interface)
-      try:
-        subprocess.check_call(dhcpcd + [interface])
-      except subprocess.CalledProcessError:
-        # The interface is already active.
-        logger.warning('Could not activate interface %s.', interface)
+    # Bring the interfaces up in parallel, one dhcpcd process per interface.
+    with open(os.devnull, 'w') as devnull:
+      processes = []
+      for interface in interfaces:
+        try:
+          processes.append((interface, subprocess.Popen(
+              self.dhcpcd_command + ('-x', interface),
+              stdout=devnull, stderr=devnull)))
+        except OSError as e:
+          logger.warning(
+              'Could not run dhcpcd for interface %s. %s.', interface, str(e))
+      for interface, process in processes:
+        if process.wait():
+          # Dhcpcd not yet running for this device.
+          logger.info('Dhcpcd not yet running for interface %s.', interface)
+
+      processes = []
+      for interface in interfaces:
+        try:
+          processes.append((interface, subprocess.Popen(
+              self.dhcpcd_command + (interface,),
+              stdout=devnull, stderr=devnull)))
+        except OSError as e:
+          logger.warning(
+              'Could not run dhcpcd for interface %s. %s.', interface, str(e))
+      for interface, process in processes:
+        if process.wait():
+          # The interface is already active.
+          logger.warning('Could not activate interface %s.', interface)
 
   def HandleClockSync(self, logger):
     """Sync the software clock with the hypervisor clock.
@@ -24,10 +24,16 @@ from google_compute_engine.test_compat import unittest
 
 class UtilsTest(unittest.TestCase):
 
+  @classmethod
+  def setUpClass(cls):
+    cls.mock_setup = mock.create_autospec(utils.Utils)
+    cls.mock_setup.network_path = '/etc/sysconfig/network'
+    cls.mock_setup.ifcfg_template = utils.Utils.ifcfg_template
+    cls.mock_setup.ifup_command = utils.Utils.ifup_command
+
   def setUp(self):
     self.mock_logger = mock.Mock()
-    self.mock_setup = mock.create_autospec(utils.Utils)
-    self.mock_setup.network_path = '/etc/sysconfig/network'
+    self.mock_setup.reset_mock()
 
   def testEnableNetworkInterfacesWithSingleNic(self):
     mocks = mock.Mock()
@@ -50,25 +56,37 @@ class UtilsTest(unittest.TestCase):
     ]
     self.assertEqual(mocks.mock_calls, expected_calls)
 
-  def testWriteIfcfg(self):
+  @mock.patch('google_compute_engine.distro_lib.sles_12.utils.os.close')
+  @mock.patch('google_compute_engine.distro_lib.sles_12.utils.os.write')
+  @mock.patch('google_compute_engine.distro_lib.sles_12.utils.os.open')
+  def testWriteIfcfg(self, mock_open, mock_write, mock_close):
     mocks = mock.Mock()
-    mock_open = mock.mock_open()
     mocks.attach_mock(mock_open, 'open')
-    with mock.patch('%s.open' % builtin, mock_open, create=False):
-
-      utils.Utils._WriteIfcfg(
-          self.mock_setup, ['eth1', 'eth2'], self.mock_logger)
-      expected_calls = [
-          mock.call.open('/etc/sysconfig/network/ifcfg-eth1', 'w'),
-          mock.call.open().__enter__(),
-          mock.call.open().write(mock.ANY),
-          mock.call.open().__exit__(None, None, None),
-          mock.call.open('/etc/sysconfig/network/ifcfg-eth2', 'w'),
-          mock.call.open().__enter__(),
-          mock.call.open().write(mock.ANY),
-          mock.call.open().__exit__(None, None, None),
-      ]
-      self.assertEqual(mocks.mock_calls, expected_calls)
+    mocks.attach_mock(mock_write, 'write')
+    mocks.attach_mock(mock_close, 'close')
+    mocks.attach_mock(self.mock_logger, 'logger')
+    mock_open.side_effect = [3, 4]
+    flags = utils.os.O_WRONLY | utils.os.O_CREAT | utils.os.O_TRUNC
+
+    utils.Utils._WriteIfcfg(
+        self.mock_setup, ['eth1', 'eth2'], self.mock_logger)
+    expected_content = (
+        '# Added by Google.\n'
+        'STARTMODE=hotplug\n'
+        'BOOTPROTO=dhcp\n'
+        'DHCLIENT_SET_DEFAULT_ROUTE=yes\n'
+        'DHCLIENT_ROUTE_PRIORITY=10%s00\n')
+    expected_calls = [
+        mock.call.open('/etc/sysconfig/network/ifcfg-eth1', flags, 0o644),
+        mock.call.write(3, (expected_content % 'eth1').encode()),
+        mock.call.close(3),
+        mock.call.logger.info(mock.ANY, 'eth1'),
+        mock.call.open('/etc/sysconfig/network/ifcfg-eth2', flags, 0o644),
+        mock.call.write(4, (expected_content % 'eth2').encode()),
+        mock.call.close(4),
+        mock.call.logger.info(mock.ANY, 'eth2'),
+    ]
+    self.assertEqual(mocks.mock_calls, expected_calls)
 
   @mock.patch(
       'google_compute_engine.distro_lib.sles_12.utils.subprocess.check_call')
@@ -79,18 +97,24 @@ class UtilsTest(unittest.TestCase):
     mock_call.side_effect = [
         None, subprocess.CalledProcessError(1, 'Test'),
     ]
+    mock_open = mock.mock_open()
+    mock_devnull = mock_open()
 
-    utils.Utils._Ifup(self.mock_setup, ['eth1', 'eth2'], self.mock_logger)
-    utils.Utils._Ifup(self.mock_setup, ['eth1', 'eth2'], self.mock_logger)
-    expectedIfupCall = [
+    with mock.patch('%s.open' % builtin, mock_open, create=False):
+      utils.Utils._Ifup(self.mock_setup, ['eth1', 'eth2'], self.mock_logger)
+      utils.Utils._Ifup(self.mock_setup, ['eth1', 'eth2'], self.mock_logger)
+    expectedIfupCall = (
         '/usr/sbin/wicked', 'ifup', '--timeout', '1', 'eth1', 'eth2',
-    ]
+    )
     expected_calls = [
-        mock.call.call(expectedIfupCall),
-        mock.call.call(expectedIfupCall),
+        mock.call.call(
+            expectedIfupCall, stdout=mock_devnull, stderr=mock_devnull),
+        mock.call.call(
+            expectedIfupCall, stdout=mock_devnull, stderr=mock_devnull),
         mock.call.logger.warning(mock.ANY, ['eth1', 'eth2']),
     ]
     self.assertEqual(mocks.mock_calls, expected_calls)
+    mock_open.assert_called_with(utils.os.devnull, 'w')
 
   @mock.patch('google_compute_engine.distro_lib.helpers.CallHwclock')
   def testHandleClockSync(self, mock_call):
@@ -28,6 +28,13 @@ class Utils(utils.Utils):
   """Utilities used by Linux guest services on SUSE 12."""
 
   network_path = constants.LOCALBASE + '/etc/sysconfig/network'
+  ifcfg_template = (
+      '# Added by Google.\n'
+      'STARTMODE=hotplug\n'
+      'BOOTPROTO=dhcp\n'
+      'DHCLIENT_SET_DEFAULT_ROUTE=yes\n'
+      'DHCLIENT_ROUTE_PRIORITY=10%s00\n')
+  ifup_command = ('/usr/sbin/wicked', 'ifup', '--timeout', '1')
 
   def EnableIpv6(self, interfaces, logger, dhclient_script=None):
     """Configure the network interfaces for IPv6 using dhclient.
@@ -67,16 +74,13 @@ class Utils(utils.Utils):
     for interface in interfaces:
       interface_config = os.path.join(
           self.network_path, 'ifcfg-%s' % interface)
-      interface_content = [
-          '# Added by Google.',
-          'STARTMODE=hotplug',
-          'BOOTPROTO=dhcp',
-          'DHCLIENT_SET_DEFAULT_ROUTE=yes',
-          'DHCLIENT_ROUTE_PRIORITY=10%s00' % interface,
-          '',
-      ]
-      with open(interface_config, 'w') as interface_file:
-        interface_file.write('\n'.join(interface_content))
+      interface_content = (self.ifcfg_template % interface).encode()
+      interface_file = os.open(
+          interface_config, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+      try:
+        os.write(interface_file, interface_content)
+      finally:
+        os.close(interface_file)
       logger.info('Created ifcfg file for interface %s.', interface)
 
   def _Ifup(self, interfaces, logger):
@@ -86,9 +90,11 @@ class Utils(utils.Utils):
       interfaces: list of string, the output device names to enable.
       logger: logger object, used to write to SysLog and serial port.
     """
-    ifup = ['/usr/sbin/wicked', 'ifup', '--timeout', '1']
     try:
-      subprocess.check_call(ifup + interfaces)
+      with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(
+            self.ifup_command + tuple(interfaces),
+            stdout=devnull, stderr=devnull)
     except subprocess.CalledProcessError:
       logger.warning('Could not activate interfaces %s.', interfaces)
 
@@ -16,17 +16,48 @@
 """Retrieve and store user provided metadata scripts."""
 
 import functools
+import random
 import re
+import shutil
 import socket
+import sys
 import tempfile
 import time
 
 from google_compute_engine import metadata_watcher
 from google_compute_engine.compat import httpclient
 from google_compute_engine.compat import urlerror
+from google_compute_engine.compat import urljoin
 from google_compute_engine.compat import urlrequest
 from google_compute_engine.compat import urlretrieve
 
+DOWNLOAD_TIMEOUT = 30
+GS_HOST = 'storage.googleapis.com'
+GS_URL_PREFIX = 'https://%s/' % GS_HOST
+RETRY_LIMIT = 3
+# Client errors that will not succeed on a retry.
+NON_RETRYABLE_HTTP_CODES = (400, 401, 403, 404)
+REDIRECT_HTTP_CODES = (301, 302, 303, 307, 308)
+
+# Google Storage URLs of the form:
+# http://<bucket>.storage.googleapis.com/<object>
+# https://<bucket>.storage.googleapis.com/<object>
+# The object may be any non-empty string that doesn't contain a wildcard.
+GS_HOST_REGEX = re.compile(
+    r'\Ahttp[s]?://(?P<bucket>[a-z0-9][-_.a-z0-9]*[a-z0-9])'
+    r'\.storage\.googleapis\.com/(?P<obj>[^\*\?]+)\Z')
+
+# Google Storage URLs of the form:
+# http://storage.googleapis.com/<bucket>/<object>
+# https://storage.googleapis.com/<bucket>/<object>
+#
+# The following are deprecated but checked:
+# http://commondatastorage.googleapis.com/<bucket>/<object>
+# https://commondatastorage.googleapis.com/<bucket>/<object>
+GS_PATH_REGEX = re.compile(
+    r'\Ahttp[s]?://(commondata)?storage\.googleapis\.com/'
+    r'(?P<bucket>[a-z0-9][-_.a-z0-9]*[a-z0-9])/(?P<obj>[^\*\?]+)\Z')
+
 
 def _RetryOnUnavailable(func):
   """Function decorator template to retry on a service unavailable exception."""
@@ -34,12 +65,16 @@ def _RetryOnUnavailable(func):
   @functools.wraps(func)
   def Wrapper(*args, **kwargs):
     final_exception = None
-    for _ in range(3):
+    for retry in range(RETRY_LIMIT):
       try:
         response = func(*args, **kwargs)
       except (httpclient.HTTPException, socket.error, urlerror.URLError) as e:
+        if getattr(e, 'code', None) in NON_RETRYABLE_HTTP_CODES:
+          raise
         final_exception = e
-        time.sleep(5)
+        if retry < RETRY_LIMIT - 1:
+          # Exponential backoff with jitter to avoid synchronized retries.
+          time.sleep(min(8, 0.5 * 2 ** retry) + random.uniform(0, 0.25))
         continue
       else:
         return response
@@ -50,7 +85,7 @@ def _RetryOnUnavailable(func):
 @_RetryOnUnavailable
 def _UrlOpenWithRetry(request):
   """Call urlopen with retry."""
-  return urlrequest.urlopen(request)
+  return urlrequest.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
 
 
 @_RetryOnUnavailable
@@ -62,8 +97,6 @@ def _UrlRetrieveWithRetry(url, dest):
 class ScriptRetriever(object):
   """A class for retrieving and storing user provided metadata scripts."""
   token_metadata_key = 'instance/service-accounts/default/token'
-  # Cached authentication token to be used when downloading from bucket.
-  token = None
 
   def __init__(self, logger, script_type):
     """Constructor.
@@ -75,6 +108,55 @@ class ScriptRetriever(object):
     self.logger = logger
     self.script_type = script_type
     self.watcher = metadata_watcher.MetadataWatcher(logger=self.logger)
+    # Cached authentication token to be used when downloading from bucket.
+    self.token = None
+    self.token_expiry = 0
+    # Set when no token could be fetched so later downloads skip the lookup.
+    self.token_unavailable = False
+    # Connection to Google Storage reused across authenticated downloads.
+    self.gs_connection = None
+
+  def _CloseStorageConnection(self):
+    """Close the shared Google Storage connection, if one is open."""
+    if self.gs_connection:
+      self.gs_connection.close()
+      self.gs_connection = None
+
+  @_RetryOnUnavailable
+  def _GetStorageResponse(self, path):
+    """Request a Google Storage object over the shared connection.
+
+    The connection is closed on failure so the next attempt reconnects.
+
+    Args:
+      path: string, the request path of the Google Storage object.
+
+    Returns:
+      HTTPResponse, the response with the contents of the object or a redirect.
+
+    Raises:
+      HTTPError: the server responded with neither the object nor a redirect.
+    """
+    if not self.gs_connection:
+      self.gs_connection = httpclient.HTTPSConnection(
+          GS_HOST, timeout=DOWNLOAD_TIMEOUT)
+    headers = {'Metadata-Flavor': 'Google', 'Authorization': self.token}
+    try:
+      self.gs_connection.request('GET', path, headers=headers)
+      response = self.gs_connection.getresponse()
+    except (httpclient.HTTPException, socket.error):
+      self._CloseStorageConnection()
+      raise
+
+    redirect = (
+        response.status in REDIRECT_HTTP_CODES
+        and response.getheader('Location'))
+    if response.status != httpclient.OK and not redirect:
+      self._CloseStorageConnection()
+      raise urlerror.HTTPError(
+          GS_URL_PREFIX + path[1:], response.status, response.reason,
+          response.msg, None)
+    return response
 
   def _DownloadAuthUrl(self, url, dest_dir):
     """Download a Google Storage URL using an authentication token.
@@ -88,6 +170,9 @@ class ScriptRetriever(object):
     Returns:
       string, the path to the file storing the metadata script.
     """
+    if self.token_unavailable:
+      return self._DownloadUrl(url, dest_dir)
+
     dest_file = tempfile.NamedTemporaryFile(dir=dest_dir, delete=False)
     dest_file.close()
     dest = dest_file.name
@@ -95,7 +180,8 @@ class ScriptRetriever(object):
     self.logger.info(
         'Downloading url from %s to %s using authentication token.', url, dest)
 
-    if not self.token:
+    # Refresh the token shortly before it expires.
+    if not self.token or time.time() >= self.token_expiry - 30:
       response = self.watcher.GetMetadata(
           self.token_metadata_key, recursive=False, retry=False)
 
@@ -103,23 +189,40 @@ class ScriptRetriever(object):
         self.logger.info(
             'Authentication token not found. Attempting unauthenticated '
             'download.')
+        self.token_unavailable = True
         return self._DownloadUrl(url, dest_dir)
 
       self.token = '%s %s' % (
           response.get('token_type', ''), response.get('access_token', ''))
+      self.token_expiry = time.time() + int(response.get('expires_in', 3600))
 
+    # Proxy settings are only honored by urlopen.
+    use_connection = (
+        url.startswith(GS_URL_PREFIX)
+        and not urlrequest.getproxies().get('https'))
     try:
-      request = urlrequest.Request(url)
-      request.add_unredirected_header('Metadata-Flavor', 'Google')
-      request.add_unredirected_header('Authorization', self.token)
-      content = _UrlOpenWithRetry(request).read().decode('utf-8')
+      if use_connection:
+        response = self._GetStorageResponse(url[len(GS_URL_PREFIX) - 1:])
+        if response.status != httpclient.OK:
+          # Follow the redirect without the authentication token, as urlopen
+          # does for unredirected headers.
+          location = urljoin.urljoin(url, response.getheader('Location'))
+          self._CloseStorageConnection()
+          response = _UrlOpenWithRetry(urlrequest.Request(location))
+      else:
+        request = urlrequest.Request(url)
+        request.add_unredirected_header('Metadata-Flavor', 'Google')
+        request.add_unredirected_header('Authorization', self.token)
+        response = _UrlOpenWithRetry(request)
+      with open(dest, 'wb') as f:
+        shutil.copyfileobj(response, f, 65536)
     except Exception as e:
+      if use_connection:
+        # The connection may be left mid-response, so start over next time.
+        self._CloseStorageConnection()
       self.logger.warning('Could not download %s. %s.', url, str(e))
       return None
 
-    with open(dest, 'w') as f:
-      f.write(content)
-
     return dest
 
   def _DownloadUrl(self, url, dest_dir):
@@ -138,7 +241,14 @@ class ScriptRetriever(object):
 
     self.logger.info('Downloading url from %s to %s.', url, dest)
     try:
-      _UrlRetrieveWithRetry(url, dest)
+      if sys.version_info < (2, 7, 9):
+        # Native Python libraries do not check SSL certificates, so use the
+        # curl based urlretrieve from compat.
+        _UrlRetrieveWithRetry(url, dest)
+      else:
+        response = _UrlOpenWithRetry(urlrequest.Request(url))
+        with open(dest, 'wb') as f:
+          shutil.copyfileobj(response, f, 65536)
       return dest
     except (httpclient.HTTPException, socket.error, urlerror.URLError) as e:
       self.logger.warning('Could not download %s. %s.', url, str(e))
@@ -158,41 +268,20 @@ class ScriptRetriever(object):
     """
     # Check for the preferred Google Storage URL format:
     # gs://<bucket>/<object>
-    if url.startswith(r'gs://'):
+    if url.startswith('gs://'):
       # Convert the string into a standard URL.
-      url = re.sub('^gs://', 'https://storage.googleapis.com/', url)
+      url = GS_URL_PREFIX + url[5:]
       return self._DownloadAuthUrl(url, dest_dir)
 
-    header = r'http[s]?://'
-    domain = r'storage\.googleapis\.com'
+    # All other Google Storage URL formats include the storage domain, so skip
+    # the regular expressions for any URL that does not.
+    if GS_HOST not in url:
+      return self._DownloadUrl(url, dest_dir)
 
     # Many of the Google Storage URLs are supported below.
     # It is prefered that customers specify their object using
     # its gs://<bucket>/<object> url.
-    bucket = r'(?P<bucket>[a-z0-9][-_.a-z0-9]*[a-z0-9])'
-
-    # Accept any non-empty string that doesn't contain a wildcard character
-    obj = r'(?P<obj>[^\*\?]+)'
-
-    # Check for the Google Storage URLs:
-    # http://<bucket>.storage.googleapis.com/<object>
-    # https://<bucket>.storage.googleapis.com/<object>
-    gs_regex = re.compile(r'\A%s%s\.%s/%s\Z' % (header, bucket, domain, obj))
-    match = gs_regex.match(url)
-    if match:
-      return self._DownloadAuthUrl(url, dest_dir)
-
-    # Check for the other possible Google Storage URLs:
-    # http://storage.googleapis.com/<bucket>/<object>
-    # https://storage.googleapis.com/<bucket>/<object>
-    #
-    # The following are deprecated but checked:
-    # http://commondatastorage.googleapis.com/<bucket>/<object>
-    # https://commondatastorage.googleapis.com/<bucket>/<object>
-    gs_regex = re.compile(
-        r'\A%s(commondata)?%s/%s/%s\Z' % (header, domain, bucket, obj))
-    match = gs_regex.match(url)
-    if match:
+    if GS_HOST_REGEX.match(url) or GS_PATH_REGEX.match(url):
       return self._DownloadAuthUrl(url, dest_dir)
 
     # Unauthenticated download of the object.
@@ -211,12 +300,13 @@ class ScriptRetriever(object):
     script_dict = {}
     attribute_data = attribute_data or {}
     metadata_key = '%s-script' % self.script_type
-    metadata_value = attribute_data.get(metadata_key)
+    # Skip scripts that are empty once leading whitespace is removed.
+    metadata_value = (attribute_data.get(metadata_key) or '').lstrip()
     if metadata_value:
       self.logger.info('Found %s in metadata.', metadata_key)
       with tempfile.NamedTemporaryFile(
           mode='w', dir=dest_dir, delete=False) as dest:
-        dest.write(metadata_value.lstrip())
+        dest.write(metadata_value)
         script_dict[metadata_key] = dest.name
 
     metadata_key = '%s-script-url' % self.script_type
@@ -253,5 +343,9 @@ class ScriptRetriever(object):
       project_data = None
       self.logger.warning('Project attributes were not found.')
 
-    return (self._GetAttributeScripts(instance_data, dest_dir)
-            or self._GetAttributeScripts(project_data, dest_dir))
+    # Fall back to project scripts only when no instance script is available,
+    # including when every instance script failed to download.
+    script_dict = self._GetAttributeScripts(instance_data, dest_dir)
+    if not any(script_dict.values()):
+      script_dict = self._GetAttributeScripts(project_data, dest_dir)
+    return script_dict
@@ -35,14 +35,24 @@ class ScriptRetrieverTest(unittest.TestCase):
     self.retriever = script_retriever.ScriptRetriever(
         self.mock_logger, self.script_type)
 
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.shutil.copyfileobj')
   @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.Request')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.getproxies')
   @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
-  def testDownloadAuthUrl(self, mock_urlopen, mock_request, mock_tempfile):
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.httpclient.HTTPSConnection')
+  def testDownloadAuthUrl(
+      self, mock_connection, mock_urlopen, mock_proxies, mock_tempfile,
+      mock_copy, mock_time):
     auth_url = 'https://storage.googleapis.com/fake/url'
     mock_tempfile.return_value = mock_tempfile
     mock_tempfile.name = self.dest
+    mock_proxies.return_value = {}
+    mock_response = mock_connection.return_value.getresponse.return_value
+    mock_response.status = script_retriever.httpclient.OK
+    mock_time.time.return_value = 100
     self.retriever.token = 'bar'
+    self.retriever.token_expiry = 3600
 
     mock_open = mock.mock_open()
     with mock.patch('%s.open' % builtin, mock_open):
@@ -54,34 +64,69 @@ class ScriptRetrieverTest(unittest.TestCase):
 
     self.mock_logger.info.assert_called_once_with(
         mock.ANY, auth_url, self.dest)
+    mock_connection.assert_called_once_with(
+        'storage.googleapis.com', timeout=script_retriever.DOWNLOAD_TIMEOUT)
+    mock_connection.return_value.request.assert_called_once_with(
+        'GET', '/fake/url',
+        headers={'Metadata-Flavor': 'Google', 'Authorization': 'bar'})
+    mock_urlopen.assert_not_called()
+    self.mock_logger.warning.assert_not_called()
+
+    mock_open.assert_called_once_with(self.dest, 'wb')
+    mock_copy.assert_called_once_with(mock_response, mock_open(), 65536)
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.shutil.copyfileobj')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.Request')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadAuthUrlBucketHost(
+      self, mock_urlopen, mock_request, mock_tempfile, mock_copy, mock_time):
+    auth_url = 'https://fake.storage.googleapis.com/url'
+    mock_tempfile.return_value = mock_tempfile
+    mock_tempfile.name = self.dest
+    mock_time.time.return_value = 100
+    self.retriever.token = 'bar'
+    self.retriever.token_expiry = 3600
+
+    mock_open = mock.mock_open()
+    with mock.patch('%s.open' % builtin, mock_open):
+      self.assertEqual(
+          self.retriever._DownloadAuthUrl(auth_url, self.dest_dir), self.dest)
+
     mock_request.assert_called_with(auth_url)
     mocked_request = mock_request()
     mocked_request.add_unredirected_header.assert_called_with(
         'Authorization', 'bar')
-    mock_urlopen.assert_called_with(mocked_request)
-    urlopen_read = mock_urlopen().read(return_value=b'foo').decode()
+    mock_urlopen.assert_called_once_with(
+        mocked_request, timeout=script_retriever.DOWNLOAD_TIMEOUT)
     self.mock_logger.warning.assert_not_called()
 
-    mock_open.assert_called_once_with(self.dest, 'w')
-    handle = mock_open()
-    handle.write.assert_called_once_with(urlopen_read)
+    mock_open.assert_called_once_with(self.dest, 'wb')
+    mock_copy.assert_called_once_with(
+        mock_urlopen.return_value, mock_open(), 65536)
 
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time')
   @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.Request')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.getproxies')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.httpclient.HTTPSConnection')
   @mock.patch('google_compute_engine.metadata_watcher.MetadataWatcher.GetMetadata')
   def testDownloadAuthUrlExceptionAndToken(
-      self, mock_get_metadata, mock_request, mock_tempfile):
+      self, mock_get_metadata, mock_connection, mock_proxies, mock_tempfile,
+      mock_time):
     auth_url = 'https://storage.googleapis.com/fake/url'
     metadata_prefix = 'http://metadata.google.internal/computeMetadata/v1/'
     token_url = metadata_prefix + 'instance/service-accounts/default/token'
     mock_tempfile.return_value = mock_tempfile
     mock_tempfile.name = self.dest
+    mock_proxies.return_value = {}
+    mock_time.time.return_value = 100
     self.retriever.token = None
 
     mock_get_metadata.return_value = {
-        'token_type': 'foo', 'access_token': 'bar'}
-    mock_request.return_value = mock_request
-    mock_request.side_effect = urlerror.URLError('Error.')
+        'token_type': 'foo', 'access_token': 'bar', 'expires_in': 1800}
+    mock_connection.return_value.request.side_effect = (
+        script_retriever.socket.error('Error.'))
 
     self.assertIsNone(self.retriever._DownloadAuthUrl(auth_url, self.dest_dir))
 
@@ -92,6 +137,12 @@ class ScriptRetrieverTest(unittest.TestCase):
         stripped_url, recursive=False, retry=False)
 
     self.assertEqual(self.retriever.token, 'foo bar')
+    self.assertEqual(self.retriever.token_expiry, 1900)
+
+    # The request is retried on a new connection each time.
+    self.assertEqual(mock_connection.call_count, 3)
+    self.assertEqual(mock_connection.return_value.close.call_count, 3)
+    self.assertIsNone(self.retriever.gs_connection)
 
     self.mock_logger.info.assert_called_once_with(
         mock.ANY, auth_url, self.dest)
@@ -123,6 +174,7 @@ class ScriptRetrieverTest(unittest.TestCase):
     mock_download_url.assert_called_once_with(auth_url, self.dest_dir)
 
     self.assertIsNone(self.retriever.token)
+    self.assertTrue(self.retriever.token_unavailable)
 
     expected_calls = [
         mock.call(mock.ANY, auth_url, self.dest),
@@ -130,63 +182,432 @@ class ScriptRetrieverTest(unittest.TestCase):
     ]
     self.assertEqual(self.mock_logger.info.mock_calls, expected_calls)
 
+    # Later downloads skip the token lookup.
+    mock_get_metadata.reset_mock()
+    mock_download_url.reset_mock()
+    self.assertIsNone(self.retriever._DownloadAuthUrl(auth_url, self.dest_dir))
+    mock_get_metadata.assert_not_called()
+    mock_download_url.assert_called_once_with(auth_url, self.dest_dir)
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.shutil.copyfileobj')
   @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlretrieve.urlretrieve')
-  def testDownloadUrl(self, mock_retrieve, mock_tempfile):
-    url = 'http://www.google.com/fake/url'
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.getproxies')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.httpclient.HTTPSConnection')
+  @mock.patch('google_compute_engine.metadata_watcher.MetadataWatcher.GetMetadata')
+  def testDownloadAuthUrlTokenExpiry(
+      self, mock_get_metadata, mock_connection, mock_proxies, mock_tempfile,
+      mock_copy, mock_time):
+    auth_url = 'https://storage.googleapis.com/fake/url'
+    mock_tempfile.return_value = mock_tempfile
+    mock_tempfile.name = self.dest
+    mock_proxies.return_value = {}
+    mock_response = mock_connection.return_value.getresponse.return_value
+    mock_response.status = script_retriever.httpclient.OK
+    mock_get_metadata.return_value = {
+        'token_type': 'foo', 'access_token': 'bar', 'expires_in': 100}
+    mock_open = mock.mock_open()
+
+    with mock.patch('%s.open' % builtin, mock_open):
+      # The first download fetches a token.
+      mock_time.time.return_value = 0
+      self.retriever._DownloadAuthUrl(auth_url, self.dest_dir)
+      self.assertEqual(mock_get_metadata.call_count, 1)
+      self.assertEqual(self.retriever.token_expiry, 100)
+
+      # The cached token is reused while it is valid.
+      mock_time.time.return_value = 50
+      self.retriever._DownloadAuthUrl(auth_url, self.dest_dir)
+      self.assertEqual(mock_get_metadata.call_count, 1)
+
+      # The token is refreshed when it is about to expire.
+      mock_time.time.return_value = 80
+      self.retriever._DownloadAuthUrl(auth_url, self.dest_dir)
+      self.assertEqual(mock_get_metadata.call_count, 2)
+      self.assertEqual(self.retriever.token_expiry, 180)
+    self.mock_logger.warning.assert_not_called()
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.shutil.copyfileobj')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.getproxies')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.httpclient.HTTPSConnection')
+  def testDownloadAuthUrlConnection(
+      self, mock_connection, mock_urlopen, mock_proxies, mock_tempfile,
+      mock_copy):
+    auth_urls = [
+        'https://storage.googleapis.com/fake/url',
+        'https://storage.googleapis.com/fake/other',
+    ]
     mock_tempfile.return_value = mock_tempfile
     mock_tempfile.name = self.dest
+    mock_proxies.return_value = {}
+    mock_response = mock_connection.return_value.getresponse.return_value
+    mock_response.status = script_retriever.httpclient.OK
+    self.retriever.token = 'bar'
+    self.retriever.token_expiry = float('inf')
+    headers = {'Metadata-Flavor': 'Google', 'Authorization': 'bar'}
+
+    mock_open = mock.mock_open()
+    with mock.patch('%s.open' % builtin, mock_open):
+      for auth_url in auth_urls:
+        self.assertEqual(
+            self.retriever._DownloadAuthUrl(auth_url, self.dest_dir),
+            self.dest)
+
+    # A single connection is used for both downloads.
+    mock_connection.assert_called_once_with(
+        'storage.googleapis.com', timeout=script_retriever.DOWNLOAD_TIMEOUT)
+    expected_calls = [
+        mock.call('GET', '/fake/url', headers=headers),
+        mock.call('GET', '/fake/other', headers=headers),
+    ]
     self.assertEqual(
-        self.retriever._DownloadUrl(url, self.dest_dir), self.dest)
+        mock_connection.return_value.request.mock_calls, expected_calls)
+    self.assertEqual(mock_copy.call_count, 2)
+    mock_copy.assert_called_with(mock_response, mock_open(), 65536)
+    mock_urlopen.assert_not_called()
+    self.mock_logger.warning.assert_not_called()
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.shutil.copyfileobj')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.getproxies')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.httpclient.HTTPSConnection')
+  def testDownloadAuthUrlConnectionReset(
+      self, mock_connection, mock_proxies, mock_tempfile, mock_copy,
+      mock_time):
+    auth_url = 'https://storage.googleapis.com/fake/url'
+    mock_tempfile.return_value = mock_tempfile
+    mock_tempfile.name = self.dest
+    mock_proxies.return_value = {}
+    mock_stale = mock.Mock()
+    mock_stale.getresponse.side_effect = (
+        script_retriever.httpclient.BadStatusLine(''))
+    mock_fresh = mock.Mock()
+    mock_fresh.getresponse.return_value.status = (
+        script_retriever.httpclient.OK)
+    mock_connection.side_effect = [mock_stale, mock_fresh]
+    self.retriever.token = 'bar'
+    mock_time.time.return_value = 0
+    self.retriever.token_expiry = float('inf')
+
+    with mock.patch('%s.open' % builtin, mock.mock_open()):
+      self.assertEqual(
+          self.retriever._DownloadAuthUrl(auth_url, self.dest_dir), self.dest)
+    mock_stale.close.assert_called_once_with()
+    self.assertEqual(self.retriever.gs_connection, mock_fresh)
+    mock_copy.assert_called_once_with(
+        mock_fresh.getresponse.return_value, mock.ANY, 65536)
+    self.assertEqual(mock_time.sleep.call_count, 1)
+    self.mock_logger.warning.assert_not_called()
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.shutil.copyfileobj')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.getproxies')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.httpclient.HTTPSConnection')
+  def testDownloadAuthUrlConnectionTransientError(
+      self, mock_connection, mock_proxies, mock_tempfile, mock_copy,
+      mock_time):
+    auth_urls = [
+        'https://storage.googleapis.com/fake/url',
+        'https://storage.googleapis.com/fake/other',
+    ]
+    mock_tempfile.return_value = mock_tempfile
+    mock_tempfile.name = self.dest
+    mock_proxies.return_value = {}
+    mock_unavailable = mock.Mock()
+    mock_unavailable.getresponse.return_value.status = 503
+    mock_shared = mock.Mock()
+    mock_shared.getresponse.return_value.status = (
+        script_retriever.httpclient.OK)
+    mock_connection.side_effect = [mock_unavailable, mock_shared]
+    self.retriever.token = 'bar'
+    mock_time.time.return_value = 0
+    self.retriever.token_expiry = float('inf')
+
+    with mock.patch('%s.open' % builtin, mock.mock_open()):
+      for auth_url in auth_urls:
+        self.assertEqual(
+            self.retriever._DownloadAuthUrl(auth_url, self.dest_dir),
+            self.dest)
+
+    # The failed attempt is retried on a new connection, which is then shared
+    # by the following download.
+    mock_unavailable.close.assert_called_once_with()
+    self.assertEqual(mock_connection.call_count, 2)
+    self.assertEqual(mock_shared.request.call_count, 2)
+    mock_shared.close.assert_not_called()
+    self.assertEqual(self.retriever.gs_connection, mock_shared)
+    self.assertEqual(mock_time.sleep.call_count, 1)
+    self.assertEqual(mock_copy.call_count, 2)
+    self.mock_logger.warning.assert_not_called()
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.shutil.copyfileobj')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.getproxies')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.httpclient.HTTPSConnection')
+  def testDownloadAuthUrlConnectionError(
+      self, mock_connection, mock_proxies, mock_tempfile, mock_copy,
+      mock_time):
+    auth_url = 'https://storage.googleapis.com/fake/url'
+    mock_tempfile.return_value = mock_tempfile
+    mock_tempfile.name = self.dest
+    mock_proxies.return_value = {}
+    mock_response = mock_connection.return_value.getresponse.return_value
+    mock_response.status = 404
+    self.retriever.token = 'bar'
+    mock_time.time.return_value = 0
+    self.retriever.token_expiry = float('inf')
+
+    self.assertIsNone(self.retriever._DownloadAuthUrl(auth_url, self.dest_dir))
+    # Client errors are not retried.
+    mock_connection.assert_called_once_with(
+        'storage.googleapis.com', timeout=script_retriever.DOWNLOAD_TIMEOUT)
+    mock_connection.return_value.close.assert_called_once_with()
+    mock_time.sleep.assert_not_called()
+    self.assertIsNone(self.retriever.gs_connection)
+    mock_copy.assert_not_called()
+    self.assertEqual(self.mock_logger.warning.call_count, 1)
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.shutil.copyfileobj')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.getproxies')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.Request')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.httpclient.HTTPSConnection')
+  def testDownloadAuthUrlConnectionRedirect(
+      self, mock_connection, mock_urlopen, mock_request, mock_proxies,
+      mock_tempfile, mock_copy):
+    auth_url = 'https://storage.googleapis.com/fake/url'
+    redirect_url = 'https://www.google.com/fake/url'
+    mock_tempfile.return_value = mock_tempfile
+    mock_tempfile.name = self.dest
+    mock_proxies.return_value = {}
+    mock_response = mock_connection.return_value.getresponse.return_value
+    mock_response.status = 302
+    mock_response.getheader.return_value = redirect_url
+    self.retriever.token = 'bar'
+    self.retriever.token_expiry = float('inf')
+
+    with mock.patch('%s.open' % builtin, mock.mock_open()):
+      self.assertEqual(
+          self.retriever._DownloadAuthUrl(auth_url, self.dest_dir), self.dest)
+    mock_response.getheader.assert_called_with('Location')
+    mock_connection.return_value.close.assert_called_once_with()
+    # The redirect is followed without the authentication token.
+    mock_request.assert_called_once_with(redirect_url)
+    mock_request.return_value.add_unredirected_header.assert_not_called()
+    mock_urlopen.assert_called_once_with(
+        mock_request.return_value, timeout=script_retriever.DOWNLOAD_TIMEOUT)
+    mock_copy.assert_called_once_with(
+        mock_urlopen.return_value, mock.ANY, 65536)
+    self.mock_logger.warning.assert_not_called()
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.shutil.copyfileobj')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.getproxies')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.Request')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.httpclient.HTTPSConnection')
+  def testDownloadAuthUrlConnectionRelativeRedirect(
+      self, mock_connection, mock_urlopen, mock_request, mock_proxies,
+      mock_tempfile, mock_copy):
+    auth_url = 'https://storage.googleapis.com/fake/url'
+    mock_tempfile.return_value = mock_tempfile
+    mock_tempfile.name = self.dest
+    mock_proxies.return_value = {}
+    mock_response = mock_connection.return_value.getresponse.return_value
+    mock_response.status = 302
+    mock_response.getheader.return_value = '/other/obj'
+    self.retriever.token = 'bar'
+    self.retriever.token_expiry = float('inf')
+
+    with mock.patch('%s.open' % builtin, mock.mock_open()):
+      self.assertEqual(
+          self.retriever._DownloadAuthUrl(auth_url, self.dest_dir), self.dest)
+    # The location is resolved against the requested URL.
+    mock_request.assert_called_once_with(
+        'https://storage.googleapis.com/other/obj')
+    mock_copy.assert_called_once_with(
+        mock_urlopen.return_value, mock.ANY, 65536)
+    self.mock_logger.warning.assert_not_called()
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.shutil.copyfileobj')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.getproxies')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.httpclient.HTTPSConnection')
+  def testDownloadAuthUrlConnectionNoRedirect(
+      self, mock_connection, mock_urlopen, mock_proxies, mock_tempfile,
+      mock_copy, mock_time):
+    auth_url = 'https://storage.googleapis.com/fake/url'
+    mock_tempfile.return_value = mock_tempfile
+    mock_tempfile.name = self.dest
+    mock_proxies.return_value = {}
+    mock_time.time.return_value = 0
+    mock_response = mock_connection.return_value.getresponse.return_value
+    self.retriever.token = 'bar'
+    self.retriever.token_expiry = float('inf')
+
+    # Neither a redirect without a location nor a 304 is saved as a script.
+    for status, location in ((302, None), (304, None), (304, '/other/obj')):
+      mock_response.status = status
+      mock_response.getheader.return_value = location
+      self.mock_logger.reset_mock()
+      with mock.patch('%s.open' % builtin, mock.mock_open()):
+        self.assertIsNone(
+            self.retriever._DownloadAuthUrl(auth_url, self.dest_dir))
+      self.assertIsNone(self.retriever.gs_connection)
+      self.assertEqual(self.mock_logger.warning.call_count, 1)
+    mock_copy.assert_not_called()
+    mock_urlopen.assert_not_called()
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.shutil.copyfileobj')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.getproxies')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.Request')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.httpclient.HTTPSConnection')
+  def testDownloadAuthUrlProxy(
+      self, mock_connection, mock_urlopen, mock_request, mock_proxies,
+      mock_tempfile, mock_copy):
+    auth_url = 'https://storage.googleapis.com/fake/url'
+    mock_tempfile.return_value = mock_tempfile
+    mock_tempfile.name = self.dest
+    mock_proxies.return_value = {'https': 'http://proxy:3128'}
+    self.retriever.token = 'bar'
+    self.retriever.token_expiry = float('inf')
+
+    with mock.patch('%s.open' % builtin, mock.mock_open()):
+      self.assertEqual(
+          self.retriever._DownloadAuthUrl(auth_url, self.dest_dir), self.dest)
+    # Downloads through a proxy use urlopen, which honors proxy settings.
+    mock_connection.assert_not_called()
+    mock_request.assert_called_once_with(auth_url)
+    mock_request.return_value.add_unredirected_header.assert_called_with(
+        'Authorization', 'bar')
+    mock_urlopen.assert_called_once_with(
+        mock_request.return_value, timeout=script_retriever.DOWNLOAD_TIMEOUT)
+    self.mock_logger.warning.assert_not_called()
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.shutil.copyfileobj')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.Request')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadUrl(self, mock_urlopen, mock_request, mock_tempfile, mock_copy):
+    url = 'http://www.google.com/fake/url'
+    mock_tempfile.return_value = mock_tempfile
+    mock_tempfile.name = self.dest
+    mock_open = mock.mock_open()
+    with mock.patch('%s.open' % builtin, mock_open):
+      self.assertEqual(
+          self.retriever._DownloadUrl(url, self.dest_dir), self.dest)
     mock_tempfile.assert_called_once_with(dir=self.dest_dir, delete=False)
     mock_tempfile.close.assert_called_once_with()
     self.mock_logger.info.assert_called_once_with(mock.ANY, url, self.dest)
+    mock_request.assert_called_once_with(url)
+    mock_urlopen.assert_called_once_with(
+        mock_request.return_value,
+        timeout=script_retriever.DOWNLOAD_TIMEOUT)
+    mock_open.assert_called_once_with(self.dest, 'wb')
+    mock_copy.assert_called_once_with(
+        mock_urlopen.return_value, mock_open(), 65536)
+    self.mock_logger.warning.assert_not_called()
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.sys')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlretrieve.urlretrieve')
+  def testDownloadUrlLegacyPython(
+      self, mock_retrieve, mock_urlopen, mock_tempfile, mock_sys):
+    url = 'https://www.google.com/fake/url'
+    mock_tempfile.return_value = mock_tempfile
+    mock_tempfile.name = self.dest
+    mock_sys.version_info = (2, 7, 8)
+    self.assertEqual(
+        self.retriever._DownloadUrl(url, self.dest_dir), self.dest)
     mock_retrieve.assert_called_once_with(url, self.dest)
+    mock_urlopen.assert_not_called()
     self.mock_logger.warning.assert_not_called()
 
   @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.shutil.copyfileobj')
   @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlretrieve.urlretrieve')
-  def testDownloadUrlProcessError(self, mock_retrieve, mock_tempfile, mock_time):
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadUrlProcessError(
+      self, mock_urlopen, mock_tempfile, mock_copy, mock_time):
     url = 'http://www.google.com/fake/url'
     mock_tempfile.return_value = mock_tempfile
     mock_tempfile.name = self.dest
     mock_success = mock.Mock()
     mock_success.getcode.return_value = script_retriever.httpclient.OK
     # Success after 3 timeout. Since max_retry = 3, the final result is fail.
-    mock_retrieve.side_effect = [
+    mock_urlopen.side_effect = [
         script_retriever.socket.timeout(),
         script_retriever.socket.timeout(),
         script_retriever.socket.timeout(),
         mock_success,
     ]
-    self.assertIsNone(self.retriever._DownloadUrl(url, self.dest_dir))
+    with mock.patch('%s.open' % builtin, mock.mock_open()):
+      self.assertIsNone(self.retriever._DownloadUrl(url, self.dest_dir))
     self.assertEqual(self.mock_logger.warning.call_count, 1)
+    mock_copy.assert_not_called()
 
   @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.shutil.copyfileobj')
   @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlretrieve.urlretrieve')
-  def testDownloadUrlWithRetry(self, mock_retrieve, mock_tempfile, mock_time):
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadUrlWithRetry(
+      self, mock_urlopen, mock_tempfile, mock_copy, mock_time):
     url = 'http://www.google.com/fake/url'
     mock_tempfile.return_value = mock_tempfile
     mock_tempfile.name = self.dest
     mock_success = mock.Mock()
     mock_success.getcode.return_value = script_retriever.httpclient.OK
     # Success after 2 timeout. Since max_retry = 3, the final result is success.
-    mock_retrieve.side_effect = [
+    mock_urlopen.side_effect = [
         script_retriever.socket.timeout(),
         script_retriever.socket.timeout(),
         mock_success,
     ]
-    self.assertIsNotNone(self.retriever._DownloadUrl(url, self.dest_dir))
+    with mock.patch('%s.open' % builtin, mock.mock_open()):
+      self.assertIsNotNone(self.retriever._DownloadUrl(url, self.dest_dir))
+    mock_copy.assert_called_once_with(mock_success, mock.ANY, 65536)
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.random')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testUrlOpenWithRetryBackoff(self, mock_urlopen, mock_time, mock_random):
+    mock_random.uniform.return_value = 0.1
+    mock_urlopen.side_effect = script_retriever.socket.timeout()
+    with self.assertRaises(script_retriever.socket.timeout):
+      script_retriever._UrlOpenWithRetry('request')
+    self.assertEqual(mock_urlopen.call_count, 3)
+    expected_calls = [mock.call.sleep(0.6), mock.call.sleep(1.1)]
+    self.assertEqual(mock_time.mock_calls, expected_calls)
+
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.time')
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testUrlOpenWithRetryNotFound(self, mock_urlopen, mock_time):
+    mock_urlopen.side_effect = urlerror.HTTPError(
+        'http://www.google.com/fake/url', 404, 'Not Found', {}, None)
+    with self.assertRaises(urlerror.HTTPError):
+      script_retriever._UrlOpenWithRetry('request')
+    mock_urlopen.assert_called_once_with(
+        'request', timeout=script_retriever.DOWNLOAD_TIMEOUT)
+    mock_time.sleep.assert_not_called()
 
   @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
-  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlretrieve.urlretrieve')
-  def testDownloadUrlException(self, mock_retrieve, mock_tempfile):
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.urlrequest.urlopen')
+  def testDownloadUrlException(self, mock_urlopen, mock_tempfile):
     url = 'http://www.google.com/fake/url'
     mock_tempfile.return_value = mock_tempfile
     mock_tempfile.name = self.dest
-    mock_retrieve.side_effect = Exception('Error.')
+    mock_urlopen.side_effect = Exception('Error.')
     self.assertIsNone(self.retriever._DownloadUrl(url, self.dest_dir))
     self.assertEqual(self.mock_logger.warning.call_count, 1)
 
@@ -261,10 +682,17 @@ class ScriptRetrieverTest(unittest.TestCase):
       mock_auth_download.assert_called_once_with(new_gs_url, self.dest_dir)
       mock_download.assert_not_called()
 
+    # URLs outside of Google Storage are downloaded without a token.
+    download_urls.extend([
+        'http://www.google.com/fake/url',
+        'https://example.com/storage/googleapis/com/script.sh',
+    ])
     for url in download_urls:
+      mock_auth_download.reset_mock()
       mock_download.reset_mock()
       self.retriever._DownloadScript(url, self.dest_dir)
       mock_download.assert_called_once_with(url, self.dest_dir)
+      mock_auth_download.assert_not_called()
 
     for url, gs_url in download_gs_urls.items():
       if url.startswith('gs://'):
@@ -306,6 +734,16 @@ class ScriptRetrieverTest(unittest.TestCase):
     mock_dest.write.assert_called_once_with(script)
     mock_download.assert_called_once_with(script_url, self.dest_dir)
 
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
+  def testGetAttributeScriptsWhitespace(self, mock_tempfile):
+    attribute_data = {'%s-script' % self.script_type: ' \n\t\n'}
+    expected_data = {}
+    self.assertEqual(
+        self.retriever._GetAttributeScripts(attribute_data, self.dest_dir),
+        expected_data)
+    mock_tempfile.assert_not_called()
+    self.mock_logger.info.assert_not_called()
+
   def testGetAttributeScriptsNone(self):
     attribute_data = {}
     expected_data = {}
@@ -416,6 +854,42 @@ class ScriptRetrieverTest(unittest.TestCase):
     self.assertEqual(self.mock_logger.info.call_count, 2)
     self.assertEqual(self.mock_logger.warning.call_count, 1)
 
+  @mock.patch('google_compute_engine.metadata_scripts.script_retriever.tempfile.NamedTemporaryFile')
+  def testGetScriptsProjectFallback(self, mock_tempfile):
+    script_dest = '/tmp/script'
+    metadata = {
+        'instance': {
+            'attributes': {
+                '%s-script-url' % self.script_type: 'b',
+            },
+        },
+        'project': {
+            'attributes': {
+                '%s-script' % self.script_type: 'c',
+            },
+        },
+    }
+    expected_data = {
+        '%s-script' % self.script_type: script_dest,
+    }
+    self.mock_watcher.GetMetadata.return_value = metadata
+    self.retriever.watcher = self.mock_watcher
+    # Mock saving a script to a file.
+    mock_dest = mock.Mock()
+    mock_dest.name = script_dest
+    mock_tempfile.__enter__.return_value = mock_dest
+    mock_tempfile.return_value = mock_tempfile
+    # Mock a failed download of the instance script URL.
+    mock_download = mock.Mock()
+    mock_download.return_value = None
+    self.retriever._DownloadScript = mock_download
+
+    self.assertEqual(self.retriever.GetScripts(self.dest_dir), expected_data)
+    self.assertEqual(self.mock_logger.info.call_count, 2)
+    self.assertEqual(self.mock_logger.warning.call_count, 1)
+    mock_dest.write.assert_called_once_with('c')
+    mock_download.assert_called_once_with('b', self.dest_dir)
+
 
 if __name__ == '__main__':
   unittest.main()